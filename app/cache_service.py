@@ -1,38 +1,299 @@
 """
 In-memory caching service for extraction results
 Uses PDF content hash + extraction_schema hash as composite key
+Optionally persisted to SQLite (set CACHE_DB_PATH) to survive restarts
 """
+import atexit
 import hashlib
-import json
-from typing import Optional, Dict, Any
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, BinaryIO, Tuple
+import msgpack
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover - stdlib fallback
+    xxhash = None
+
+
+def _hash_bytes(data: bytes) -> bytes:
+    """
+    Fast non-cryptographic 128-bit hash for cache keys
+    
+    Uses xxh3 when available, otherwise BLAKE2b (stdlib, still faster than SHA-256)
+    
+    Args:
+        data: Bytes to hash
+    
+    Returns:
+        Raw 16-byte digest
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def new_pdf_hasher():
+    """
+    Create an incremental hasher producing the same digest as the PDF cache key
+    
+    Returns:
+        Hasher object with update() and digest()
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_pdf_stream(stream: BinaryIO) -> Tuple[bytes, bytes]:
+    """
+    Read a PDF file and hash it
+    
+    A single read() sizes one bytes object from the file (no chunk list joined
+    into a second copy), and bytes is what PDFium loads without a Python reader.
+    
+    Args:
+        stream: Binary file object
+    
+    Returns:
+        Tuple of (PDF digest for CacheService.generate_key, PDF content as bytes)
+    """
+    content = stream.read()
+    return _hash_bytes(content), content
+
+
+class DiskCache:
+    """
+    SQLite-backed persistent cache layer
+    
+    Reads use one connection per thread; writes are queued and applied by a
+    background thread so the request path never waits on disk sync. Pending
+    writes are flushed by close(), which also runs at interpreter exit.
+    Results are stored as msgpack blobs (smaller and faster to decode than JSON).
+    """
+    
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._local = threading.local()
+        self._queue: "queue.Queue[Tuple[str, Optional[bytes], Optional[bytes]]]" = queue.Queue()
+        
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache (key BLOB PRIMARY KEY, result BLOB NOT NULL)"
+        )
+        conn.commit()
+        
+        self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+        self._writer.start()
+        # The writer is a daemon thread, so queued results would be lost on exit
+        atexit.register(self.close)
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._db_path, timeout=5.0)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Get persisted result
+        
+        Args:
+            key: Composite cache key
+            
+        Returns:
+            Cached result dictionary or None if not found
+        """
+        try:
+            row = self._reader().execute(
+                "SELECT result FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading disk cache: {e}")
+            return None
+        if row is None:
+            return None
+        
+        try:
+            return msgpack.unpackb(row[0], raw=False)
+        except Exception as e:
+            # Unreadable blob (e.g. written by an older version): treat as a miss
+            print(f"Error decoding disk cache entry: {e}")
+            return None
+    
+    def set(self, key: bytes, result: Dict[str, Any]) -> None:
+        """
+        Queue result for persistence (written by the background thread)
+        
+        Args:
+            key: Composite cache key
+            result: Extraction result to persist
+        """
+        self._queue.put(("set", key, msgpack.packb(result, use_bin_type=True)))
+    
+    def clear(self) -> None:
+        """
+        Remove all persisted results, blocking until they are gone from disk
+        
+        Waiting keeps a concurrent get() from reading an old row back into memory.
+        """
+        self._queue.put(("clear", None, None))
+        self.flush()
+    
+    def flush(self) -> None:
+        """Block until all queued writes are on disk"""
+        if self._writer.is_alive():
+            self._queue.join()
+    
+    def close(self) -> None:
+        """Write pending results and stop the writer thread (safe to call twice)"""
+        if self._writer.is_alive():
+            self._queue.put(("stop", None, None))
+            self._writer.join()
+    
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            ops = [self._queue.get()]
+            # Drain whatever else is pending so it lands in one transaction
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for op, key, value in ops:
+                    if op == "set":
+                        conn.execute(
+                            "INSERT OR REPLACE INTO extraction_cache (key, result) VALUES (?, ?)",
+                            (key, value)
+                        )
+                    elif op == "clear":
+                        conn.execute("DELETE FROM extraction_cache")
+                    else:
+                        stopping = True
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing disk cache: {e}")
+                conn.rollback()
+            finally:
+                for _ in ops:
+                    self._queue.task_done()
+        conn.close()
 
 
 class CacheService:
-    """In-memory cache for extraction results"""
+    """In-memory LRU cache for extraction results, optionally backed by disk"""
     
-    def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        # Bounded LRU: most recently used entries live at the end
+        self._cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[DiskCache] = DiskCache(db_path) if db_path else None
     
-    def _generate_key(self, pdf_content: bytes, extraction_schema: dict) -> str:
+    def hash_schema(self, extraction_schema: dict) -> bytes:
+        """
+        Hash an extraction schema, canonicalized by sorting its keys
+        
+        Call it once where the schema enters the system (e.g. right after parsing
+        the request) and pass the digest to generate_key as schema_digest.
+        
+        Args:
+            extraction_schema: Dictionary of field names and descriptions
+        
+        Returns:
+            Raw schema digest
+        """
+        return _hash_bytes(orjson.dumps(extraction_schema, option=orjson.OPT_SORT_KEYS))
+    
+    def generate_key(
+        self,
+        pdf_content: bytes,
+        extraction_schema: dict,
+        pdf_digest: Optional[bytes] = None,
+        schema_digest: Optional[bytes] = None
+    ) -> bytes:
         """
         Generate cache key from PDF content and extraction schema
         
+        Compute it once per request and reuse it with get_by_key/set_by_key
+        to avoid hashing the PDF twice on a cache miss.
+        
         Args:
             pdf_content: PDF file content as bytes
             extraction_schema: Dictionary of field names and descriptions
-            
+            pdf_digest: PDF digest already computed while reading (skips hashing)
+            schema_digest: Schema digest from hash_schema (skips serialization)
+        
         Returns:
-            Cache key as string (hash of PDF + schema)
+            Cache key as raw bytes (PDF digest + schema digest, 32 bytes)
         """
         # Hash PDF content
-        pdf_hash = hashlib.sha256(pdf_content).hexdigest()
+        pdf_hash = pdf_digest if pdf_digest is not None else _hash_bytes(pdf_content)
         
-        # Hash extraction schema (normalize by sorting keys)
-        schema_str = json.dumps(extraction_schema, sort_keys=True)
-        schema_hash = hashlib.sha256(schema_str.encode()).hexdigest()
+        # Hash extraction schema (unless already hashed at the request boundary)
+        schema_hash = schema_digest if schema_digest is not None else self.hash_schema(extraction_schema)
         
-        # Composite key
-        return f"{pdf_hash}:{schema_hash}"
+        # Composite key (fixed-size digests, so plain concatenation is unambiguous)
+        return pdf_hash + schema_hash
+    
+    def get_by_key(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Get cached extraction result by precomputed key
+        
+        Args:
+            key: Cache key from generate_key
+        
+        Returns:
+            Cached result dictionary or None if not found
+        """
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                return result
+        
+        if self._disk is not None:
+            result = self._disk.get(key)
+            if result is not None:
+                self._store(key, result)
+        return result
+    
+    def set_by_key(self, key: bytes, result: Dict[str, Any]) -> None:
+        """
+        Cache extraction result by precomputed key
+        
+        Args:
+            key: Cache key from generate_key
+            result: Extraction result to cache
+        """
+        self._store(key, result)
+        if self._disk is not None:
+            self._disk.set(key, result)
+    
+    def _store(self, key: bytes, result: Dict[str, Any]) -> None:
+        """Insert into the in-memory LRU, evicting least recently used entries"""
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
     
     def get(self, pdf_content: bytes, extraction_schema: dict) -> Optional[Dict[str, Any]]:
         """
@@ -41,12 +302,11 @@ class CacheService:
         Args:
             pdf_content: PDF file content as bytes
             extraction_schema: Dictionary of field names and descriptions
-            
+        
         Returns:
             Cached result dictionary or None if not found
         """
-        key = self._generate_key(pdf_content, extraction_schema)
-        return self._cache.get(key)
+        return self.get_by_key(self.generate_key(pdf_content, extraction_schema))
     
     def set(self, pdf_content: bytes, extraction_schema: dict, result: Dict[str, Any]) -> None:
         """
@@ -57,18 +317,26 @@ class CacheService:
             extraction_schema: Dictionary of field names and descriptions
             result: Extraction result to cache
         """
-        key = self._generate_key(pdf_content, extraction_schema)
-        self._cache[key] = result
+        self.set_by_key(self.generate_key(pdf_content, extraction_schema), result)
     
     def clear(self) -> None:
-        """Clear all cached results"""
-        self._cache.clear()
+        """Clear all cached results (including persisted ones)"""
+        # Disk first, so a concurrent miss can't reload an old row into memory
+        if self._disk is not None:
+            self._disk.clear()
+        with self._lock:
+            self._cache.clear()
+    
+    def close(self) -> None:
+        """Write pending results to disk and stop persisting (call on shutdown)"""
+        if self._disk is not None:
+            self._disk.close()
     
     def size(self) -> int:
         """Get number of cached entries"""
         return len(self._cache)
 
 
-# Global cache instance
-cache_service = CacheService()
+# Global cache instance (persistent only when CACHE_DB_PATH is set)
+cache_service = CacheService(db_path=os.getenv("CACHE_DB_PATH"))
 
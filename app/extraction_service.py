@@ -1,74 +1,295 @@
 """
 Core extraction service orchestrating PDF → Cache → LLM → Response
 """
+import asyncio
 import time
-from typing import Dict, Optional
-from app.pdf_extractor import extract_text_from_pdf
-from app.llm_service import get_llm_service
+from typing import Any, Dict, List, Optional, Tuple
+from app.pdf_extractor import PdfContent, extract_text_from_pdf
+from app.llm_service import get_llm_service, load_encoding
 from app.cache_service import cache_service
 
 
 class ExtractionService:
     """Main extraction service coordinating all components"""
     
-    def extract(
+    # Max documents packed into a single LLM call by extract_many
+    LLM_BATCH_SIZE = 5
+    
+    def __init__(self):
+        # Cache key -> future of the extraction currently computing it, so
+        # concurrent identical requests share one LLM call
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+    
+    def _claim(self, cache_key: bytes) -> Tuple[asyncio.Future, bool]:
+        """
+        Get the in-flight future for a cache key, registering one if there is none
+        
+        Args:
+            cache_key: Cache key of the extraction
+        
+        Returns:
+            Tuple of (future, True if the caller must compute the result)
+        """
+        future = self._inflight.get(cache_key)
+        if future is not None:
+            return future, False
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        return future, True
+    
+    def _release(
         self,
-        pdf_content: bytes,
+        cache_key: bytes,
+        future: asyncio.Future,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[BaseException] = None
+    ) -> None:
+        """Resolve a claimed future and stop routing new callers to it"""
+        if self._inflight.get(cache_key) is future:
+            del self._inflight[cache_key]
+        if future.done():
+            return
+        
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+            # Only waiting callers should re-raise; don't log it as unretrieved
+            future.exception()
+        else:
+            future.set_result(result)
+    
+    @staticmethod
+    def _reused_result(result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """Result served from cache or from another caller's extraction"""
+        return {
+            "extracted_data": result["extracted_data"],
+            "cost": result.get("cost", 0.0),
+            "processing_time": time.time() - start_time,
+            "cache_hit": True
+        }
+    
+    async def extract(
+        self,
+        pdf_content: PdfContent,
         extraction_schema: Dict[str, str],
-        label: Optional[str] = None
+        label: Optional[str] = None,
+        pdf_digest: Optional[bytes] = None,
+        schema_digest: Optional[bytes] = None
     ) -> Dict[str, any]:
         """
         Extract data from PDF with caching
         
         Args:
-            pdf_content: PDF file content as bytes
+            pdf_content: PDF file content as bytes (or a read-only mmap of a large upload)
             extraction_schema: Dictionary of field names and descriptions
-            
+            pdf_digest: PDF digest computed while reading (see cache_service.hash_pdf_stream)
+            schema_digest: Schema digest computed at the request boundary (see CacheService.hash_schema)
+        
         Returns:
             Dictionary with extracted_data, cost, processing_time, cache_hit
         """
         start_time = time.time()
-        cache_hit = False
         
-        # Check cache first
-        cached_result = cache_service.get(pdf_content, extraction_schema)
+        # Check cache first (key is computed once and reused on miss)
+        cache_key = cache_service.generate_key(pdf_content, extraction_schema, pdf_digest, schema_digest)
+        cached_result = cache_service.get_by_key(cache_key)
         if cached_result:
-            cache_hit = True
-            processing_time = time.time() - start_time
-            return {
-                "extracted_data": cached_result["extracted_data"],
-                "cost": cached_result.get("cost", 0.0),
-                "processing_time": processing_time,
-                "cache_hit": True
-            }
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(pdf_content)
-        if not text:
-            processing_time = time.time() - start_time
-            return {
-                "extracted_data": {field: None for field in extraction_schema.keys()},
-                "cost": 0.0,
-                "processing_time": processing_time,
-                "cache_hit": False
-            }
-        
-        # Extract data using LLM
-        llm_service = get_llm_service()
-        extracted_data, cost = llm_service.extract_data(text, extraction_schema, label)
-        
-        # Cache the result
-        result = {
-            "extracted_data": extracted_data,
-            "cost": cost,
-            "processing_time": time.time() - start_time,
-            "cache_hit": False
-        }
-        cache_service.set(pdf_content, extraction_schema, result)
+            return self._reused_result(cached_result, start_time)
+        
+        # Join an identical extraction already in flight instead of calling the LLM again
+        future, is_owner = self._claim(cache_key)
+        if not is_owner:
+            try:
+                shared_result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The owner was cancelled; compute it ourselves
+                return await self.extract(pdf_content, extraction_schema, label, pdf_digest, schema_digest)
+            return self._reused_result(shared_result, start_time)
         
+        try:
+            # Extract text from PDF (CPU-bound, keep it off the event loop)
+            text = await asyncio.to_thread(extract_text_from_pdf, pdf_content)
+            if not text:
+                processing_time = time.time() - start_time
+                result = {
+                    "extracted_data": dict.fromkeys(extraction_schema),
+                    "cost": 0.0,
+                    "processing_time": processing_time,
+                    "cache_hit": False
+                }
+            else:
+                # Extract data using LLM
+                llm_service = get_llm_service()
+                extracted_data, cost = await llm_service.extract_data(text, extraction_schema, label)
+                
+                # Cache the result
+                result = {
+                    "extracted_data": extracted_data,
+                    "cost": cost,
+                    "processing_time": time.time() - start_time,
+                    "cache_hit": False
+                }
+                cache_service.set_by_key(cache_key, result)
+        except BaseException as e:
+            self._release(cache_key, future, error=e)
+            raise
+        
+        self._release(cache_key, future, result)
         return result
+    
+    async def extract_many(
+        self,
+        pdf_contents: List[PdfContent],
+        extraction_schema: Dict[str, str],
+        label: Optional[str] = None,
+        pdf_digests: Optional[List[bytes]] = None,
+        schema_digest: Optional[bytes] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        pdf_semaphore: Optional[asyncio.Semaphore] = None
+    ) -> List[Dict[str, any]]:
+        """
+        Extract data from several PDFs sharing one schema and label
+        
+        Cache misses are packed into multi-document LLM calls of up to
+        LLM_BATCH_SIZE documents; documents too long for the token budget
+        get a call each. If a packed response can't be matched back
+        to its documents, they are retried with one call each, and the cost of
+        the failed call is split across them.
+        
+        Args:
+            pdf_contents: PDF file contents as bytes (or read-only mmaps)
+            extraction_schema: Dictionary of field names and descriptions
+            label: Document type identifier (optional)
+            pdf_digests: PDF digests computed while reading, one per PDF
+            schema_digest: Schema digest computed at the request boundary
+            semaphore: Bounds concurrent LLM calls, shared across callers (optional)
+            pdf_semaphore: Bounds concurrent PDF text extractions (optional)
+        
+        Returns:
+            List of result dictionaries (same shape as extract) in input order
+        """
+        start_time = time.time()
+        results: List[Optional[Dict[str, any]]] = [None] * len(pdf_contents)
+        if pdf_digests is None:
+            pdf_digests = [None] * len(pdf_contents)
+        cache_keys = [
+            cache_service.generate_key(pdf_content, extraction_schema, pdf_digest, schema_digest)
+            for pdf_content, pdf_digest in zip(pdf_contents, pdf_digests)
+        ]
+        
+        # Serve cache hits first; join extractions already in flight
+        misses = []
+        claimed: Dict[int, asyncio.Future] = {}
+        joined: List[Tuple[int, asyncio.Future]] = []
+        for i, cache_key in enumerate(cache_keys):
+            cached_result = cache_service.get_by_key(cache_key)
+            if cached_result:
+                results[i] = self._reused_result(cached_result, start_time)
+                continue
+            
+            future, is_owner = self._claim(cache_key)
+            if is_owner:
+                misses.append(i)
+                claimed[i] = future
+            else:
+                joined.append((i, future))
+        
+        async def extract_text(pdf_content: PdfContent) -> Optional[str]:
+            if pdf_semaphore is None:
+                return await asyncio.to_thread(extract_text_from_pdf, pdf_content)
+            async with pdf_semaphore:
+                return await asyncio.to_thread(extract_text_from_pdf, pdf_content)
+        
+        try:
+            # Extract text from the remaining PDFs (CPU-bound, keep it off the event loop)
+            texts = await asyncio.gather(*[extract_text(pdf_contents[i]) for i in misses])
+            pending: List[Tuple[int, str]] = []
+            for i, text in zip(misses, texts):
+                if text:
+                    pending.append((i, text))
+                else:
+                    results[i] = {
+                        "extracted_data": dict.fromkeys(extraction_schema),
+                        "cost": 0.0,
+                        "processing_time": time.time() - start_time,
+                        "cache_hit": False
+                    }
+                    self._release(cache_keys[i], claimed[i], results[i])
+            
+            # Extract data using packed LLM calls, groups running concurrently
+            llm_service = get_llm_service()
+            
+            async def call_llm(coro):
+                if semaphore is None:
+                    return await coro
+                async with semaphore:
+                    return await coro
+            
+            async def extract_group(group: List[Tuple[int, str]]) -> None:
+                group_texts = [text for _, text in group]
+                outputs = None
+                # Cost of a packed call whose response couldn't be used
+                wasted_cost = 0.0
+                if len(group) > 1:
+                    outputs, batch_cost = await call_llm(
+                        llm_service.extract_data_batch(group_texts, extraction_schema, label)
+                    )
+                    if outputs is None:
+                        wasted_cost = batch_cost / len(group)
+                if outputs is None:
+                    outputs = await asyncio.gather(*[
+                        call_llm(llm_service.extract_data(text, extraction_schema, label))
+                        for text in group_texts
+                    ])
+                
+                for (i, _), (extracted_data, cost) in zip(group, outputs):
+                    # Cache the result
+                    result = {
+                        "extracted_data": extracted_data,
+                        "cost": cost + wasted_cost,
+                        "processing_time": time.time() - start_time,
+                        "cache_hit": False
+                    }
+                    cache_service.set_by_key(cache_keys[i], result)
+                    results[i] = result
+                    self._release(cache_keys[i], claimed[i], result)
+            
+            # Documents over the token budget are trimmed, so they get their own call
+            await load_encoding()
+            packable: List[Tuple[int, str]] = []
+            groups: List[List[Tuple[int, str]]] = []
+            for item in pending:
+                if llm_service.fits_budget(item[1]):
+                    packable.append(item)
+                else:
+                    groups.append([item])
+            groups.extend(
+                packable[offset:offset + self.LLM_BATCH_SIZE]
+                for offset in range(0, len(packable), self.LLM_BATCH_SIZE)
+            )
+            await asyncio.gather(*[extract_group(group) for group in groups])
+        except BaseException as e:
+            for i, future in claimed.items():
+                self._release(cache_keys[i], future, error=e)
+            raise
+        
+        # Results shared with other callers (or duplicates within this batch)
+        for i, future in joined:
+            try:
+                results[i] = self._reused_result(await asyncio.shield(future), start_time)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                results[i] = await self.extract(
+                    pdf_contents[i], extraction_schema, label, pdf_digests[i], schema_digest
+                )
+        
+        return results
 
 
 # Global extraction service instance
 extraction_service = ExtractionService()
-
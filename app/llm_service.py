@@ -2,28 +2,117 @@
 OpenAI LLM service with optimized prompts for data extraction
 Uses GPT-5-mini for extraction
 """
-import json
+import asyncio
 import os
-from typing import Dict, Optional, Tuple
-from openai import OpenAI
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import orjson
 from dotenv import load_dotenv
 
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - fall back to a character estimate
+    tiktoken = None
+
 load_dotenv()
 
 
+# Seconds to wait for the tokenizer before estimating token counts instead
+ENCODING_LOAD_TIMEOUT = 10.0
+
+# Tokenizer used to measure prompt text (None until loaded, or if unavailable)
+_encoding = None
+_encoding_ready = threading.Event()
+_encoding_lock = threading.Lock()
+_encoding_loader: Optional[threading.Thread] = None
+_encoding_deadline = 0.0
+
+
+def _load_encoding() -> None:
+    """Load the tokenizer, keeping the character estimate if it is unavailable"""
+    global _encoding
+    try:
+        if tiktoken is not None:
+            # May download the encoding file (no timeout) on a cold cache
+            _encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception as e:
+        print(f"Error loading tiktoken encoding, estimating tokens instead: {e}")
+    finally:
+        _encoding_ready.set()
+
+
+async def load_encoding() -> None:
+    """
+    Load the tokenizer in a background thread, waiting for it until
+    ENCODING_LOAD_TIMEOUT seconds after the load started
+    
+    Safe to call repeatedly. If the load is slow (e.g. a stalled download),
+    token counts are estimated until it finishes, without waiting again.
+    """
+    global _encoding_loader, _encoding_deadline
+    if _encoding_ready.is_set():
+        return
+    with _encoding_lock:
+        if _encoding_loader is None:
+            _encoding_deadline = time.monotonic() + ENCODING_LOAD_TIMEOUT
+            # Daemon thread: a hung download must not keep the process alive
+            _encoding_loader = threading.Thread(target=_load_encoding, name="tiktoken-loader", daemon=True)
+            _encoding_loader.start()
+    remaining = _encoding_deadline - time.monotonic()
+    if remaining > 0:
+        await asyncio.to_thread(_encoding_ready.wait, remaining)
+
+
+def _count_tokens(text: str) -> int:
+    """Count tokens with tiktoken, or estimate ~4 characters per token without it"""
+    if _encoding is None:
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _fits_tokens(text: str, max_tokens: int) -> bool:
+    """Check whether text is within a token budget"""
+    # Fast path: byte-level BPE never yields more tokens than UTF-8 bytes
+    return len(text.encode()) <= max_tokens or _count_tokens(text) <= max_tokens
+
+
 class LLMService:
     """OpenAI LLM service for structured data extraction"""
     
+    # Token budget for PDF text in a single prompt
+    MAX_TEXT_TOKENS = 8000
+    # Chunk size (chars) used when localizing relevant text in long documents
+    TEXT_CHUNK_SIZE = 1024
+    # Upper bound on memoized schema prompt blocks
+    SCHEMA_BLOCK_CACHE_SIZE = 256
+    
     def __init__(self):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable not set")
         
-        # Initialize OpenAI client with explicit api_key parameter only
-        self.client = OpenAI(api_key=api_key)
+        # Imported here so startup doesn't pay for the SDK until the first LLM call
+        import httpx
+        from openai import AsyncOpenAI
+        
+        # HTTP/2 multiplexes concurrent batch requests over pooled connections,
+        # avoiding a TLS handshake per call (timeouts match the SDK defaults)
+        http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=httpx.Timeout(600.0, connect=5.0),
+        )
+        
+        # Initialize async OpenAI client with explicit api_key parameter only
+        # (awaiting the API frees the event loop for other requests)
+        self.client = AsyncOpenAI(api_key=api_key, http_client=http_client)
         self.model = "gpt-5-mini"  # Cost-effective model as specified
+        # id(extraction_schema) -> (schema items snapshot, "Fields to extract" block)
+        self._schema_block_cache: Dict[int, Tuple[tuple, str]] = {}
     
-    def extract_data(
+    async def extract_data(
         self, 
         text: str, 
         extraction_schema: Dict[str, str],
@@ -39,33 +128,11 @@ class LLMService:
         Returns:
             Tuple of (extracted_data dictionary, cost in USD)
         """
-        # Build optimized prompt
-        prompt = self._build_prompt(text, extraction_schema, label)
-        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a data extraction assistant. Extract information from the given text and return ONLY valid JSON. If a field cannot be found, return null for that field."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                response_format={"type": "json_object"},
-            )
-            
-            # Calculate cost for gpt-5-mini
-            # Pricing: Input: $0.075 per 1M tokens, Output: $0.30 per 1M tokens
-            input_tokens = response.usage.prompt_tokens
-            output_tokens = response.usage.completion_tokens
-            cost = (input_tokens * 0.075 / 1_000_000) + (output_tokens * 0.30 / 1_000_000)
-            
-            # Parse response
-            result_json = json.loads(response.choices[0].message.content)
+            await load_encoding()
+            # Build optimized prompt
+            prompt = self._build_prompt(text, extraction_schema, label)
+            result_json, cost = await self._complete(prompt)
             
             # Ensure all schema fields are present
             extracted_data = {}
@@ -77,7 +144,88 @@ class LLMService:
         except Exception as e:
             print(f"Error in LLM extraction: {e}")
             # Return null values for all fields on error
-            return {field: None for field in extraction_schema.keys()}, 0.0
+            return dict.fromkeys(extraction_schema), 0.0
+    
+    async def extract_data_batch(
+        self,
+        texts: List[str],
+        extraction_schema: Dict[str, str],
+        label: Optional[str] = None
+    ) -> Tuple[Optional[List[Tuple[Dict[str, Optional[str]], float]]], float]:
+        """
+        Extract structured data from several documents in a single LLM call
+        
+        Documents must share the same schema and label. The call cost is split
+        evenly across documents.
+        
+        Args:
+            texts: Extracted PDF texts
+            extraction_schema: Dictionary mapping field names to descriptions
+            label: Document type identifier (optional)
+            
+        Returns:
+            Tuple of (list of (extracted_data dictionary, cost in USD) in input
+            order, total cost in USD). The list is None if the response can't be
+            matched back to the documents; the cost of that call is still returned.
+        """
+        cost = 0.0
+        try:
+            await load_encoding()
+            prompt = self._build_batch_prompt(texts, extraction_schema, label)
+            result_json, cost = await self._complete(prompt)
+            
+            documents = result_json.get("documents")
+            if not isinstance(documents, list) or len(documents) != len(texts):
+                raise ValueError(f"expected {len(texts)} documents in response")
+            
+            cost_per_document = cost / len(texts)
+            results = []
+            for document in documents:
+                if not isinstance(document, dict):
+                    raise ValueError("document result is not a JSON object")
+                # Ensure all schema fields are present
+                extracted_data = {field: document.get(field) for field in extraction_schema.keys()}
+                results.append((extracted_data, cost_per_document))
+            
+            return results, cost
+            
+        except Exception as e:
+            print(f"Error in batched LLM extraction: {e}")
+            return None, cost
+    
+    async def _complete(self, prompt: str) -> Tuple[dict, float]:
+        """
+        Run a JSON-mode chat completion
+        
+        Args:
+            prompt: User prompt
+            
+        Returns:
+            Tuple of (parsed JSON response, cost in USD)
+        """
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a data extraction assistant. Extract information from the given text and return ONLY valid JSON. If a field cannot be found, return null for that field."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            response_format={"type": "json_object"},
+        )
+        
+        # Calculate cost for gpt-5-mini
+        # Pricing: Input: $0.075 per 1M tokens, Output: $0.30 per 1M tokens
+        input_tokens = response.usage.prompt_tokens
+        output_tokens = response.usage.completion_tokens
+        cost = (input_tokens * 0.075 / 1_000_000) + (output_tokens * 0.30 / 1_000_000)
+        
+        # Parse response
+        return orjson.loads(response.choices[0].message.content), cost
     
     def _build_prompt(self, text: str, extraction_schema: Dict[str, str], label: Optional[str] = None) -> str:
         """
@@ -91,27 +239,157 @@ class LLMService:
         Returns:
             Optimized prompt string
         """
-        # Build field descriptions (minimal format)
-        schema_parts = []
-        for field, description in extraction_schema.items():
-            schema_parts.append(f'"{field}": {description}')
-        
-        schema_text = "\n".join(schema_parts)
+        # Keep long documents within the token budget
+        text = self._fit_text(text, extraction_schema)
         
         # Add label information to prompt if available
         label_context = ""
         if label:
             label_context = f"\nDocument type (label): {label}\n"
         
-        prompt = f"""Extract the following fields from this text. Return JSON only.{label_context}
-
-Fields to extract:
-{schema_text}
-
-Text:
-{text}"""
+        schema_block = self._schema_block(extraction_schema)
+        
+        return f"Extract the following fields from this text. Return JSON only.{label_context}{schema_block}\n\nText:\n{text}"
+    
+    def _build_batch_prompt(
+        self,
+        texts: List[str],
+        extraction_schema: Dict[str, str],
+        label: Optional[str] = None
+    ) -> str:
+        """
+        Build a prompt packing several documents, asking for a JSON array of results
+        
+        Each document gets the full MAX_TEXT_TOKENS budget, so it is prompted
+        exactly as it would be on its own (see fits_budget).
+        
+        Args:
+            texts: PDF text contents
+            extraction_schema: Field descriptions
+            label: Document type identifier (optional)
+            
+        Returns:
+            Prompt string
+        """
+        documents = "\n\n".join(
+            f"=== DOCUMENT {i} ===\n{self._fit_text(text, extraction_schema)}"
+            for i, text in enumerate(texts, 1)
+        )
+        
+        label_context = ""
+        if label:
+            label_context = f"\nDocument type (label): {label}\n"
+        
+        schema_block = self._schema_block(extraction_schema)
+        
+        return (
+            f"Extract the following fields from each of the {len(texts)} documents below. "
+            f'Return JSON only, as {{"documents": [...]}} with one object per document, in order.'
+            f"{label_context}{schema_block}\n\n{documents}"
+        )
+    
+    def fits_budget(self, text: str) -> bool:
+        """
+        Check whether text fits the per-document token budget untrimmed
+        
+        Documents that don't are extracted with their own call rather than packed.
+        Await load_encoding() first so the check uses real token counts.
+        
+        Args:
+            text: PDF text content
+            
+        Returns:
+            True if the text is within MAX_TEXT_TOKENS
+        """
+        return _fits_tokens(text, self.MAX_TEXT_TOKENS)
+    
+    def _schema_block(self, extraction_schema: Dict[str, str]) -> str:
+        """
+        Get the "Fields to extract" prompt block, memoized per schema object
+        
+        Batches reuse one schema dict across many PDFs, so the block is built once.
+        The items snapshot guards against id() reuse and in-place mutation.
+        
+        Args:
+            extraction_schema: Field descriptions
+            
+        Returns:
+            Prompt block listing the fields in minimal format
+        """
+        sid = id(extraction_schema)
+        items = tuple(extraction_schema.items())
+        cached = self._schema_block_cache.get(sid)
+        if cached is not None and cached[0] == items:
+            return cached[1]
+        
+        # Build field descriptions (minimal format)
+        schema_text = "\n".join(f'"{field}": {description}' for field, description in items)
+        schema_block = f"\n\nFields to extract:\n{schema_text}"
+        
+        if len(self._schema_block_cache) >= self.SCHEMA_BLOCK_CACHE_SIZE:
+            self._schema_block_cache.clear()
+        self._schema_block_cache[sid] = (items, schema_block)
+        return schema_block
+    
+    def _fit_text(
+        self,
+        text: str,
+        extraction_schema: Dict[str, str],
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        Trim text to a token budget, keeping the chunks most relevant to the schema
+        
+        Chunks are scored by how often schema field keywords appear in them;
+        the best ones are kept in their original order.
+        
+        Args:
+            text: PDF text content
+            extraction_schema: Field descriptions
+            max_tokens: Token budget (defaults to MAX_TEXT_TOKENS)
+            
+        Returns:
+            Text within the token budget
+        """
+        if max_tokens is None:
+            max_tokens = self.MAX_TEXT_TOKENS
+        
+        if _fits_tokens(text, max_tokens):
+            return text
+        
+        chunks = [
+            text[i:i + self.TEXT_CHUNK_SIZE]
+            for i in range(0, len(text), self.TEXT_CHUNK_SIZE)
+        ]
+        
+        # Keywords from field names, e.g. "endereco_profissional" -> endereco, profissional
+        keywords = {
+            word
+            for field in extraction_schema.keys()
+            for word in re.split(r"[\W_]+", field.lower())
+            if len(word) >= 3
+        }
+        if keywords:
+            pattern = re.compile(
+                "|".join(re.escape(word) for word in sorted(keywords, key=len, reverse=True)),
+                re.IGNORECASE
+            )
+            scores = [len(pattern.findall(chunk)) for chunk in chunks]
+        else:
+            scores = [0] * len(chunks)
+        
+        # Highest score first; ties keep document order
+        ranked = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+        selected: List[int] = []
+        used_tokens = 0
+        for i in ranked:
+            chunk_tokens = _count_tokens(chunks[i])
+            if used_tokens + chunk_tokens > max_tokens:
+                continue
+            selected.append(i)
+            used_tokens += chunk_tokens
         
-        return prompt
+        return "\n...\n".join(chunks[i] for i in sorted(selected))
 
 
 # Global LLM service instance (lazy initialization)
@@ -1,15 +1,20 @@
 """
 FastAPI application with extraction endpoints
 """
+import asyncio
+import mmap
 import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from typing import Dict
-import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import orjson
 
-from app.models import ExtractionRequest, ExtractionResponse, BatchExtractionRequest, BatchExtractionResponse
+from app.models import ExtractionRequest, ExtractionResponse, BatchItem, BatchExtractionRequest, BatchExtractionResponse
 from app.extraction_service import extraction_service
+from app.llm_service import load_encoding
+from app.cache_service import cache_service, hash_pdf_stream, new_pdf_hasher
 
 app = FastAPI(
     title="PDF Data Extraction API",
@@ -33,12 +38,58 @@ async def root():
         return "<html><body><h1>PDF Extraction API</h1><p>Frontend not found. Use /docs for API documentation.</p></body></html>"
 
 
+@app.on_event("startup")
+async def startup() -> None:
+    """Load the tokenizer off the event loop before serving requests"""
+    await load_encoding()
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    """Persist cache writes still queued for disk"""
+    cache_service.close()
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {"status": "healthy"}
 
 
+def _digest_pdf(content: Union[bytes, mmap.mmap]) -> bytes:
+    """Digest of an in-memory or memory-mapped PDF, matching the cache key"""
+    hasher = new_pdf_hasher()
+    hasher.update(content)
+    return hasher.digest()
+
+
+@asynccontextmanager
+async def _open_upload(pdf: UploadFile) -> AsyncIterator[Tuple[Union[bytes, mmap.mmap], bytes]]:
+    """
+    Expose an uploaded PDF as a bytes-like buffer, along with its digest
+    
+    Starlette already spools uploads over 1 MiB to a temporary file; those are
+    memory-mapped in place, so hashing and parsing read from the page cache
+    instead of copying the PDF into the heap. Uploads still held in memory are
+    read directly.
+    
+    Args:
+        pdf: Uploaded PDF file
+        
+    Yields:
+        Tuple of (PDF content as bytes or read-only mmap, PDF digest for the cache key)
+    """
+    # Same check as UploadFile: a SpooledTemporaryFile that hasn't rolled to disk
+    if not getattr(pdf.file, "_rolled", True):
+        content = await pdf.read()
+        yield content, _digest_pdf(content)
+        return
+    
+    with mmap.mmap(pdf.file.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+        # Hashing reads the whole file, so keep it off the event loop
+        yield pdf_map, await asyncio.to_thread(_digest_pdf, pdf_map)
+
+
 @app.post("/extract", response_model=ExtractionResponse)
 async def extract(
     label: str = Form(...),
@@ -59,15 +110,18 @@ async def extract(
     try:
         # Parse extraction schema
         try:
-            schema_dict = json.loads(extraction_schema)
-        except json.JSONDecodeError:
+            schema_dict = orjson.loads(extraction_schema)
+        except orjson.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON in extraction_schema")
         
-        # Read PDF content
-        pdf_content = await pdf.read()
+        # Hash the schema once here and reuse the digest for the cache key
+        schema_digest = cache_service.hash_schema(schema_dict)
         
-        # Extract data
-        result = extraction_service.extract(pdf_content, schema_dict, label)
+        # Read PDF content and extract data
+        async with _open_upload(pdf) as (pdf_content, pdf_digest):
+            result = await extraction_service.extract(
+                pdf_content, schema_dict, label, pdf_digest, schema_digest
+            )
         
         return ExtractionResponse(
             extracted_data=result["extracted_data"],
@@ -80,12 +134,116 @@ async def extract(
         raise HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
 
 
+# Max PDFs read from disk or parsed at once within an /extract-batch request
+BATCH_PDF_CONCURRENCY = 8
+
+
+def _read_batch_pdf(item: BatchItem) -> Tuple[bytes, bytes]:
+    """
+    Read and hash the PDF referenced by a batch item
+    
+    Args:
+        item: BatchItem with pdf_path (absolute, or relative to cwd or files/)
+        
+    Returns:
+        Tuple of (PDF digest for the cache key, PDF file content as bytes)
+    """
+    pdf_path = item.pdf_path
+    if not os.path.exists(pdf_path):
+        # Try relative to files directory
+        pdf_path = os.path.join("files", item.pdf_path)
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF not found: {item.pdf_path}")
+    
+    with open(pdf_path, "rb") as f:
+        return hash_pdf_stream(f)
+
+
+def _empty_response(item: BatchItem) -> ExtractionResponse:
+    """Response with null fields for a batch item that failed"""
+    return ExtractionResponse(
+        extracted_data=dict.fromkeys(item.extraction_schema),
+        cost=0.0,
+        processing_time=0.0,
+        cache_hit=False
+    )
+
+
+async def _process_batch_group(
+    items: List[BatchItem],
+    semaphore: asyncio.Semaphore,
+    pdf_semaphore: asyncio.Semaphore
+) -> List[ExtractionResponse]:
+    """
+    Process batch items sharing the same label and schema
+    
+    The PDFs go through extraction_service.extract_many, so cache misses are
+    packed into multi-document LLM calls.
+    
+    Args:
+        items: BatchItems with identical label and extraction_schema
+        semaphore: Bounds concurrent LLM calls across the whole batch
+        pdf_semaphore: Bounds concurrent PDF reads and text extractions across the batch
+        
+    Returns:
+        ExtractionResponse per item, in input order (null fields if it fails)
+    """
+    async def read_pdf(item: BatchItem) -> Tuple[bytes, bytes]:
+        async with pdf_semaphore:
+            return await asyncio.to_thread(_read_batch_pdf, item)
+    
+    responses: List[Optional[ExtractionResponse]] = [None] * len(items)
+    pdf_contents = []
+    pdf_digests = []
+    positions = []
+    reads = await asyncio.gather(*[read_pdf(item) for item in items], return_exceptions=True)
+    for i, (item, read) in enumerate(zip(items, reads)):
+        if isinstance(read, Exception):
+            # Isolate failures so other items keep processing
+            responses[i] = _empty_response(item)
+            continue
+        pdf_digest, pdf_content = read
+        pdf_contents.append(pdf_content)
+        pdf_digests.append(pdf_digest)
+        positions.append(i)
+    
+    if pdf_contents:
+        try:
+            # All items share the schema, so hash it once for the group
+            extraction_schema = items[0].extraction_schema
+            results = await extraction_service.extract_many(
+                pdf_contents,
+                extraction_schema,
+                items[0].label,
+                pdf_digests,
+                cache_service.hash_schema(extraction_schema),
+                semaphore,
+                pdf_semaphore
+            )
+            for i, result in zip(positions, results):
+                responses[i] = ExtractionResponse(
+                    extracted_data=result["extracted_data"],
+                    cost=result["cost"],
+                    processing_time=result["processing_time"],
+                    cache_hit=result["cache_hit"]
+                )
+        except Exception:
+            for i in positions:
+                responses[i] = _empty_response(items[i])
+    
+    return responses
+
+
 @app.post("/extract-batch", response_model=BatchExtractionResponse)
 async def extract_batch(batch_request: BatchExtractionRequest):
     """
     Process multiple extraction requests in batch.
-    IMPORTANT: Processing is done SERIALLY (sequentially), one item at a time.
-    Each item is processed completely and independently before moving to the next.
+    Items sharing a label and schema are grouped, and their cache misses are
+    packed up to extraction_service.LLM_BATCH_SIZE per LLM call.
+    Groups are processed CONCURRENTLY, with up to batch_request.parallel LLM
+    calls and BATCH_PDF_CONCURRENCY PDF reads or parses in flight, since each
+    item mostly waits on the LLM API. Failures stay isolated per item,
+    and results keep the order of the requests.
     The first item should be returned in less than 10 seconds.
     
     Args:
@@ -94,49 +252,29 @@ async def extract_batch(batch_request: BatchExtractionRequest):
     Returns:
         BatchExtractionResponse with all results and totals
     """
-    import os
-    
     start_time = time.time()
-    results = []
-    total_cost = 0.0
     
-    # Process each request SERIALLY (one at a time, in sequence)
-    # Each item is processed completely before moving to the next
-    for item in batch_request.requests:
-        try:
-            # Read PDF from path
-            pdf_path = item.pdf_path
-            if not os.path.exists(pdf_path):
-                # Try relative to files directory
-                pdf_path = os.path.join("files", item.pdf_path)
-                if not os.path.exists(pdf_path):
-                    raise FileNotFoundError(f"PDF not found: {item.pdf_path}")
-            
-            with open(pdf_path, "rb") as f:
-                pdf_content = f.read()
-            
-            # Extract data - processing happens sequentially (serially)
-            # This ensures each request is processed independently and completely
-            # before moving to the next one
-            result = extraction_service.extract(pdf_content, item.extraction_schema, item.label)
-            total_cost += result["cost"]
-            
-            # Append result immediately after processing (serial execution)
-            results.append(ExtractionResponse(
-                extracted_data=result["extracted_data"],
-                cost=result["cost"],
-                processing_time=result["processing_time"],
-                cache_hit=result["cache_hit"]
-            ))
-        except Exception as e:
-            # Continue processing other requests even if one fails
-            results.append(ExtractionResponse(
-                extracted_data={field: None for field in item.extraction_schema.keys()},
-                cost=0.0,
-                processing_time=0.0,
-                cache_hit=False
-            ))
+    # Group request indexes by (label, schema), preserving request order
+    groups: Dict[tuple, List[int]] = {}
+    for i, item in enumerate(batch_request.requests):
+        group_key = (item.label, tuple(sorted(item.extraction_schema.items())))
+        groups.setdefault(group_key, []).append(i)
+    
+    # Overlap the LLM calls, with at most batch_request.parallel in flight
+    semaphore = asyncio.Semaphore(batch_request.parallel)
+    pdf_semaphore = asyncio.Semaphore(BATCH_PDF_CONCURRENCY)
+    results: List[Optional[ExtractionResponse]] = [None] * len(batch_request.requests)
+    
+    async def process_group(indexes: List[int]) -> None:
+        responses = await _process_batch_group(
+            [batch_request.requests[i] for i in indexes], semaphore, pdf_semaphore
+        )
+        for i, response in zip(indexes, responses):
+            results[i] = response
+    
+    await asyncio.gather(*[process_group(indexes) for indexes in groups.values()])
     
+    total_cost = sum(result.cost for result in results)
     total_processing_time = time.time() - start_time
     
     return BatchExtractionResponse(
@@ -148,5 +286,6 @@ async def extract_batch(batch_request: BatchExtractionRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop/http "auto" pick uvloop and httptools (from uvicorn[standard]) when installed
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto")
 
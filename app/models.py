@@ -2,7 +2,7 @@
 Pydantic models for request and response validation
 """
 from typing import Dict, Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ExtractionRequest(BaseModel):
@@ -29,6 +29,7 @@ class BatchItem(BaseModel):
 class BatchExtractionRequest(BaseModel):
     """Request model for batch extraction"""
     requests: List[BatchItem]
+    parallel: int = Field(default=8, ge=1)  # Max concurrent LLM calls
 
 
 class BatchExtractionResponse(BaseModel):
@@ -4,36 +4,159 @@ Extracts embedded text from single-page PDFs.
 Note: PDFs already contain text (no OCR needed - text is embedded in the PDF).
 """
 import io
-import pdfplumber
-from typing import Optional
+import mmap
+from typing import Optional, Union
 
+# PDF content: bytes, or a read-only mmap for large uploads
+PdfContent = Union[bytes, mmap.mmap]
 
-def extract_text_from_pdf(pdf_content: bytes) -> Optional[str]:
+# PDF libraries are imported on first use: pdfplumber pulls in pdfminer.six,
+# which is slow to load and not needed when requests are served from cache
+_pdfium = None
+_pdfplumber = None
+
+
+def _get_pdfium():
+    """Import pypdfium2 on first use"""
+    global _pdfium
+    if _pdfium is None:
+        import pypdfium2
+        _pdfium = pypdfium2
+    return _pdfium
+
+
+def _get_pdfplumber():
+    """Import pdfplumber on first use"""
+    global _pdfplumber
+    if _pdfplumber is None:
+        import pdfplumber
+        _pdfplumber = pdfplumber
+    return _pdfplumber
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Read-only file-like view over a bytes-like buffer
+    
+    Lets PDF libraries read bytes or a memory-mapped upload without copying it first.
+    Close it to release the buffer (an mmap can't be closed while viewed).
+    """
+    
+    def __init__(self, buffer: PdfContent):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def _extract_with_pdfium(pdf_content: PdfContent) -> Optional[str]:
+    """
+    Extract text from the first page using PDFium (native, fast path)
+    
+    Args:
+        pdf_content: PDF file content as bytes or mmap
+    
+    Returns:
+        Extracted text as string, or None if the page has no text
+    """
+    # PDFium loads bytes directly; other buffers are read through a file-like view
+    reader = None if isinstance(pdf_content, bytes) else _BufferReader(pdf_content)
+    pdf = None
+    page = None
+    textpage = None
+    try:
+        pdf = _get_pdfium().PdfDocument(pdf_content if reader is None else reader)
+        if len(pdf) == 0:
+            return None
+        
+        # Extract text from first (and only) page
+        page = pdf[0]
+        textpage = page.get_textpage()
+        text = textpage.get_text_range()
+        
+        return text if text and text.strip() else None
+    finally:
+        if textpage is not None:
+            textpage.close()
+        if page is not None:
+            page.close()
+        if pdf is not None:
+            pdf.close()
+        if reader is not None:
+            reader.close()
+
+
+def _extract_with_pdfplumber(pdf_content: PdfContent) -> Optional[str]:
+    """
+    Extract text from the first page using pdfplumber (fallback path)
+    
+    Args:
+        pdf_content: PDF file content as bytes or mmap
+    
+    Returns:
+        Extracted text as string, or None if the page has no text
+    """
+    # pdfplumber only takes a path or a stream, not raw bytes; read through a
+    # view of the buffer instead of copying it into a BytesIO
+    with _BufferReader(pdf_content) as reader, _get_pdfplumber().open(reader) as pdf:
+        if len(pdf.pages) == 0:
+            return None
+        
+        # Extract text from first (and only) page
+        page = pdf.pages[0]
+        text = page.extract_text()
+        
+        return text if text else None
+
+
+def extract_text_from_pdf(pdf_content: PdfContent) -> Optional[str]:
     """
     Extract embedded text from PDF file content.
     The PDF already contains text (no OCR processing needed).
+    Uses PDFium first and falls back to pdfplumber when it yields no text.
     
     Args:
-        pdf_content: PDF file content as bytes
-        
+        pdf_content: PDF file content as bytes, or a read-only mmap of a large upload
+    
     Returns:
         Extracted text as string, or None if extraction fails
     """
     try:
-        # Convert bytes to BytesIO for pdfplumber
-        pdf_file = io.BytesIO(pdf_content)
-        
-        with pdfplumber.open(pdf_file) as pdf:
-            if len(pdf.pages) == 0:
-                return None
-            
-            # Extract text from first (and only) page
-            page = pdf.pages[0]
-            text = page.extract_text()
-            
-            return text if text else None
-            
+        text = _extract_with_pdfium(pdf_content)
+        if text:
+            return text
+    except Exception as e:
+        print(f"Error extracting PDF text with pdfium: {e}")
+    
+    try:
+        return _extract_with_pdfplumber(pdf_content)
     except Exception as e:
         print(f"Error extracting PDF text: {e}")
         return None
-
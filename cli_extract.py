@@ -4,20 +4,23 @@ CLI script for batch PDF extraction
 Supports JSON file input and folder-based processing
 """
 import argparse
-import json
+import asyncio
 import os
 import sys
 import time
 from pathlib import Path
 
+import orjson
+
 from app.extraction_service import extraction_service
+from app.cache_service import cache_service, hash_pdf_stream
 from app.models import BatchItem, ExtractionResponse
 
 
 def load_batch_json(json_path: str) -> list:
     """Load batch requests from JSON file"""
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read())
     
     if not isinstance(data, list):
         raise ValueError("JSON file must contain an array of requests")
@@ -25,79 +28,106 @@ def load_batch_json(json_path: str) -> list:
     return data
 
 
-def process_batch(batch_data: list, base_dir: str = "files") -> list:
+async def process_item(item: dict, index: int, total: int, base_dir: str = "files") -> dict:
+    """
+    Process a single extraction request
+    
+    Args:
+        item: Dictionary with label, extraction_schema, pdf_path
+        index: 1-based position of the item in the batch
+        total: Number of items in the batch
+        base_dir: Base directory for PDF files
+        
+    Returns:
+        Extraction result dictionary (with "error" key on failure)
+    """
+    try:
+        # Construct PDF path
+        pdf_path = item.get('pdf_path', '')
+        if not os.path.isabs(pdf_path):
+            pdf_path = os.path.join(base_dir, pdf_path)
+        
+        if not os.path.exists(pdf_path):
+            print(f"[{index}/{total}] ERROR: PDF not found: {pdf_path}")
+            return {
+                "label": item.get('label', 'unknown'),
+                "pdf_path": item.get('pdf_path', ''),
+                "error": f"PDF not found: {pdf_path}",
+                "extracted_data": None
+            }
+        
+        # Read and hash PDF
+        with open(pdf_path, 'rb') as f:
+            pdf_digest, pdf_content = hash_pdf_stream(f)
+        
+        # Extract data - each request is processed independently
+        extraction_schema = item.get('extraction_schema', {})
+        label = item.get('label', None)
+        # Hash the schema once here and reuse the digest for the cache key
+        schema_digest = cache_service.hash_schema(extraction_schema)
+        result = await extraction_service.extract(
+            pdf_content, extraction_schema, label, pdf_digest, schema_digest
+        )
+        
+        print(f"[{index}/{total}] {item.get('label', 'unknown')} - "
+              f"{result['processing_time']:.3f}s - "
+              f"${result['cost']:.6f} - "
+              f"{'CACHE' if result['cache_hit'] else 'LLM'}")
+        
+        return {
+            "label": item.get('label', 'unknown'),
+            "pdf_path": item.get('pdf_path', ''),
+            "extracted_data": result['extracted_data'],
+            "cost": result['cost'],
+            "processing_time": result['processing_time'],
+            "cache_hit": result['cache_hit']
+        }
+        
+    except Exception as e:
+        print(f"[{index}/{total}] ERROR: {str(e)}")
+        return {
+            "label": item.get('label', 'unknown'),
+            "pdf_path": item.get('pdf_path', ''),
+            "error": str(e),
+            "extracted_data": None
+        }
+
+
+def process_batch(batch_data: list, base_dir: str = "files", parallel: int = 8) -> list:
     """
-    Process batch of extraction requests SERIALLY (sequentially).
-    Each item is processed completely and independently before moving to the next.
+    Process batch of extraction requests CONCURRENTLY.
+    Up to `parallel` items are in flight at once; each item is still processed
+    independently and results keep the input order.
     
     Args:
         batch_data: List of dictionaries with label, extraction_schema, pdf_path
         base_dir: Base directory for PDF files
+        parallel: Maximum number of concurrent extractions
         
     Returns:
         List of extraction results
     """
-    results = []
-    total_cost = 0.0
     start_time = time.time()
+    total = len(batch_data)
     
-    print(f"Processing {len(batch_data)} documents SERIALLY (one at a time)...")
+    print(f"Processing {total} documents ({parallel} in parallel)...")
     print("-" * 60)
     
-    # Process each item SERIALLY - one at a time, in sequence
-    # Each item is processed completely before moving to the next
-    for i, item in enumerate(batch_data, 1):
-        try:
-            # Construct PDF path
-            pdf_path = item.get('pdf_path', '')
-            if not os.path.isabs(pdf_path):
-                pdf_path = os.path.join(base_dir, pdf_path)
-            
-            if not os.path.exists(pdf_path):
-                print(f"[{i}/{len(batch_data)}] ERROR: PDF not found: {pdf_path}")
-                results.append({
-                    "label": item.get('label', 'unknown'),
-                    "pdf_path": item.get('pdf_path', ''),
-                    "error": f"PDF not found: {pdf_path}",
-                    "extracted_data": None
-                })
-                continue
-            
-            # Read PDF
-            with open(pdf_path, 'rb') as f:
-                pdf_content = f.read()
-            
-            # Extract data - processing happens SERIALLY (sequentially)
-            # Each request is processed independently and completely before the next
-            extraction_schema = item.get('extraction_schema', {})
-            label = item.get('label', None)
-            result = extraction_service.extract(pdf_content, extraction_schema, label)
-            
-            total_cost += result['cost']
-            
-            print(f"[{i}/{len(batch_data)}] {item.get('label', 'unknown')} - "
-                  f"{result['processing_time']:.3f}s - "
-                  f"${result['cost']:.6f} - "
-                  f"{'CACHE' if result['cache_hit'] else 'LLM'}")
-            
-            results.append({
-                "label": item.get('label', 'unknown'),
-                "pdf_path": item.get('pdf_path', ''),
-                "extracted_data": result['extracted_data'],
-                "cost": result['cost'],
-                "processing_time": result['processing_time'],
-                "cache_hit": result['cache_hit']
-            })
-            
-        except Exception as e:
-            print(f"[{i}/{len(batch_data)}] ERROR: {str(e)}")
-            results.append({
-                "label": item.get('label', 'unknown'),
-                "pdf_path": item.get('pdf_path', ''),
-                "error": str(e),
-                "extracted_data": None
-            })
+    # LLM calls are I/O-bound, so overlapping them on one event loop is enough
+    async def run_all() -> list:
+        semaphore = asyncio.Semaphore(parallel)
+        
+        async def process_bounded(index: int, item: dict) -> dict:
+            async with semaphore:
+                return await process_item(item, index, total, base_dir)
+        
+        return await asyncio.gather(*[
+            process_bounded(i, item) for i, item in enumerate(batch_data, 1)
+        ])
+    
+    results = asyncio.run(run_all())
     
+    total_cost = sum(r.get('cost', 0.0) for r in results)
     total_time = time.time() - start_time
     print("-" * 60)
     print(f"Total: {len(batch_data)} documents")
@@ -118,6 +148,7 @@ Examples:
   python cli_extract.py --json dataset.json
   python cli_extract.py --json dataset.json --output results.json
   python cli_extract.py --json dataset.json --base-dir /path/to/pdfs
+  python cli_extract.py --json dataset.json --parallel 4
         """
     )
     
@@ -141,6 +172,13 @@ Examples:
         help='Output JSON file path (default: print to stdout)'
     )
     
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=8,
+        help='Maximum number of concurrent extractions (default: 8)'
+    )
+    
     args = parser.parse_args()
     
     # Validate JSON file exists
@@ -159,9 +197,13 @@ Examples:
         print("Error: JSON file is empty or contains no requests")
         sys.exit(1)
     
+    if args.parallel < 1:
+        print("Error: --parallel must be at least 1")
+        sys.exit(1)
+    
     # Process batch
     try:
-        results = process_batch(batch_data, args.base_dir)
+        results = process_batch(batch_data, args.base_dir, args.parallel)
         
         # Output results
         output_data = {
@@ -174,12 +216,12 @@ Examples:
         }
         
         if args.output:
-            with open(args.output, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
+            with open(args.output, 'wb') as f:
+                f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
             print(f"\nResults saved to: {args.output}")
         else:
             print("\nResults:")
-            print(json.dumps(output_data, indent=2, ensure_ascii=False))
+            print(orjson.dumps(output_data, option=orjson.OPT_INDENT_2).decode())
             
     except KeyboardInterrupt:
         print("\n\nInterrupted by user")
@@ -3,12 +3,15 @@
 Test script for PDF extraction system
 Validates extraction with provided dataset
 """
-import json
+import asyncio
 import os
 import time
 from pathlib import Path
 
+import orjson
+
 from app.extraction_service import extraction_service
+from app.cache_service import hash_pdf_stream
 
 
 def test_extraction():
@@ -20,8 +23,8 @@ def test_extraction():
         print(f"Error: {dataset_path} not found")
         return False
     
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        dataset = json.load(f)
+    with open(dataset_path, 'rb') as f:
+        dataset = orjson.loads(f.read())
     
     print(f"Testing with {len(dataset)} documents from dataset.json")
     print("=" * 70)
@@ -31,6 +34,9 @@ def test_extraction():
     total_time = 0.0
     cache_hits = 0
     
+    # One event loop for the whole run so the async OpenAI client can reuse connections
+    loop = asyncio.new_event_loop()
+    
     for i, item in enumerate(dataset, 1):
         label = item.get('label', 'unknown')
         schema = item.get('extraction_schema', {})
@@ -48,14 +54,14 @@ def test_extraction():
             })
             continue
         
-        # Read PDF
+        # Read and hash PDF
         with open(full_path, 'rb') as f:
-            pdf_content = f.read()
+            pdf_digest, pdf_content = hash_pdf_stream(f)
         
         # Extract
         start = time.time()
         try:
-            result = extraction_service.extract(pdf_content, schema, label)
+            result = loop.run_until_complete(extraction_service.extract(pdf_content, schema, label, pdf_digest))
             elapsed = time.time() - start
             
             total_cost += result['cost']
@@ -96,9 +102,11 @@ def test_extraction():
                 'error': str(e)
             })
     
+    loop.close()
+    
     # Save results to a JSON file
-    with open(f'results_{i}.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    with open(f'results_{i}.json', 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     print(f"Results saved to: results_{i}.json")
     
     # Summary
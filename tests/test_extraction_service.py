@@ -0,0 +1,133 @@
+"""
+Tests for request coalescing and packed extraction in ExtractionService
+The LLM call is stubbed, so no API key or network access is needed.
+Run with: python -m unittest discover tests
+"""
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app import extraction_service as extraction_module
+from app import llm_service as llm_module
+from app.cache_service import cache_service
+from app.extraction_service import ExtractionService
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files")
+SCHEMA = {"nome": "Nome do profissional"}
+
+
+def setUpModule():
+    # Stay offline: count tokens with the estimate instead of loading tiktoken
+    llm_module._encoding_ready.set()
+
+
+def _read_pdf(name: str) -> bytes:
+    with open(os.path.join(FILES_DIR, name), "rb") as f:
+        return f.read()
+
+
+class ExtractionServiceTest(unittest.IsolatedAsyncioTestCase):
+    """Coalescing, cancellation, error propagation and packing fallback"""
+    
+    def setUp(self):
+        cache_service.clear()
+        self.service = ExtractionService()
+        self.llm_service = llm_module.get_llm_service()
+        self.prompts = []
+        self.responses = []
+    
+    def tearDown(self):
+        cache_service.clear()
+    
+    def _stub_llm(self, complete=None):
+        """Replace the OpenAI call, recording prompts"""
+        async def fake_complete(prompt):
+            self.prompts.append(prompt)
+            await asyncio.sleep(0.01)
+            return self.responses.pop(0) if self.responses else ({"nome": "X"}, 0.01)
+        
+        patcher = mock.patch.object(self.llm_service, "_complete", complete or fake_complete)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    async def test_concurrent_identical_extracts_share_one_llm_call(self):
+        self._stub_llm()
+        pdf_content = _read_pdf("oab_1.pdf")
+        
+        results = await asyncio.gather(*[
+            self.service.extract(pdf_content, SCHEMA, "carteira_oab") for _ in range(5)
+        ])
+        
+        self.assertEqual(len(self.prompts), 1)
+        self.assertEqual([r["extracted_data"] for r in results], [{"nome": "X"}] * 5)
+        self.assertEqual(sum(not r["cache_hit"] for r in results), 1)
+        self.assertEqual(self.service._inflight, {})
+    
+    async def test_waiter_recomputes_after_owner_is_cancelled(self):
+        release = asyncio.Event()
+        
+        async def complete(prompt):
+            self.prompts.append(prompt)
+            # Only the first (owner's) call blocks
+            if len(self.prompts) == 1:
+                await release.wait()
+            return {"nome": "X"}, 0.01
+        
+        self._stub_llm(complete)
+        pdf_content = _read_pdf("oab_1.pdf")
+        
+        owner = asyncio.create_task(self.service.extract(pdf_content, SCHEMA, "carteira_oab"))
+        while not self.prompts:
+            await asyncio.sleep(0)
+        waiter = asyncio.create_task(self.service.extract(pdf_content, SCHEMA, "carteira_oab"))
+        await asyncio.sleep(0)
+        owner.cancel()
+        
+        result = await waiter
+        
+        self.assertTrue(owner.cancelled())
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(result["extracted_data"], {"nome": "X"})
+        self.assertFalse(result["cache_hit"])
+        self.assertEqual(self.service._inflight, {})
+    
+    async def test_error_reaches_all_waiters(self):
+        self._stub_llm()
+        
+        def failing_extract(pdf_content):
+            raise RuntimeError("broken PDF")
+        
+        pdf_content = _read_pdf("oab_1.pdf")
+        with mock.patch.object(extraction_module, "extract_text_from_pdf", failing_extract):
+            results = await asyncio.gather(
+                *[self.service.extract(pdf_content, SCHEMA, "carteira_oab") for _ in range(3)],
+                return_exceptions=True
+            )
+        
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+        self.assertEqual(self.prompts, [])
+        self.assertEqual(self.service._inflight, {})
+    
+    async def test_malformed_packed_response_falls_back_and_charges_its_cost(self):
+        self._stub_llm()
+        # Packed call returns the wrong number of documents
+        self.responses = [({"documents": [{"nome": "A"}]}, 0.06)]
+        pdf_contents = [_read_pdf(f"oab_{i}.pdf") for i in (1, 2, 3)]
+        
+        results = await self.service.extract_many(pdf_contents, SCHEMA, "carteira_oab")
+        
+        self.assertEqual(len(self.prompts), 4)
+        self.assertIn("=== DOCUMENT 3 ===", self.prompts[0])
+        self.assertEqual([r["extracted_data"] for r in results], [{"nome": "X"}] * 3)
+        # Each document pays its own call plus a third of the wasted packed call
+        for result in results:
+            self.assertAlmostEqual(result["cost"], 0.01 + 0.06 / 3)
+        self.assertEqual(self.service._inflight, {})
+
+
+if __name__ == "__main__":
+    unittest.main()